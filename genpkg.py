@@ -2,22 +2,23 @@
 # genpkg.py – mini gerenciador de pacotes fonte para LFS-like
 # Recursos: recipes (YAML) em repo git, deps recursivas, patches, DESTDIR+fakeroot,
 # empacotamento .tar.gz, logs, cores, strip opcional, upgrade, spinner, bin dir, clean.
+# Opcional: GENPKG_AIOHTTP=1 faz o prefetch de downloads num event loop aiohttp (se instalado).
 
 import os
 import sys
 import json
+import asyncio
+import hashlib
 import yaml
 import tarfile
 import shutil
-import bz2
-import lzma
-import time
 import itertools
 import threading
 import argparse
 import subprocess
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 from colorama import Fore, Style, init as colorama_init
 
 # =============================
@@ -37,6 +38,7 @@ DESTDIR_BASE   = "destdir"                                # instalação fake po
 PACKAGES_DIR   = "packages"                               # pacotes .tar.gz gerados
 LOGS_DIR       = "logs"                                   # logs por pacote
 BIN_DIR        = os.path.expanduser("~/.genpkg/bin")      # onde copiar binários (usr/bin)
+USE_AIOHTTP    = os.environ.get("GENPKG_AIOHTTP") == "1"  # opt-in: prefetch via aiohttp (se instalado)
 
 CHROOT_ENV     = {}                                       # reservado p/ futuro (ex: chroot)
 CHECK_ICON     = "[✔]"
@@ -44,6 +46,9 @@ UNCHECK_ICON   = "[ ]"
 
 colorama_init(autoreset=True)
 
+# libyaml (C) quando disponível; senão o parser puro-Python
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # =============================
 # Helpers
 # =============================
@@ -57,27 +62,37 @@ def ensure_dirs():
         os.makedirs(d, exist_ok=True)
 
 class Spinner:
-    def __init__(self, message="Processando..."):
+    """Só desenha em TTY e só se a operação passar de min_duration segundos."""
+    def __init__(self, message="Processando...", min_duration=1.0):
         self.message = message
-        self._stop = False
-        self._thread = None
+        self.min_duration = min_duration
+        self._stop = threading.Event()
+        self._timer = None
+        self._drawn = False
         self._frames = itertools.cycle(['⠋','⠙','⠹','⠸','⠼','⠴','⠦','⠧','⠇','⠏'])
 
+    def _run(self):
+        self._drawn = True
+        while not self._stop.is_set():
+            sys.stdout.write(Fore.YELLOW + f"\r{self.message} " + next(self._frames))
+            sys.stdout.flush()
+            self._stop.wait(0.1)
+
     def start(self):
-        def run():
-            while not self._stop:
-                sys.stdout.write(Fore.YELLOW + f"\r{self.message} " + next(self._frames))
-                sys.stdout.flush()
-                time.sleep(0.1)
-        self._thread = threading.Thread(target=run, daemon=True)
-        self._thread.start()
+        if not sys.stdout.isatty():
+            return
+        self._timer = threading.Timer(self.min_duration, self._run)
+        self._timer.daemon = True
+        self._timer.start()
 
     def stop(self):
-        self._stop = True
-        if self._thread:
-            self._thread.join()
-        sys.stdout.write("\r" + " " * 80 + "\r")
-        sys.stdout.flush()
+        self._stop.set()
+        if self._timer:
+            self._timer.cancel()
+            self._timer.join()
+        if self._drawn:
+            sys.stdout.write("\r" + " " * 80 + "\r")
+            sys.stdout.flush()
 
 class pushd:
     """Context manager para trocar diretório e voltar ao final."""
@@ -99,36 +114,76 @@ def run_cmd(cmd, *, shell=False, check=True, env=None, stdout=None, stderr=None)
 def run_shell_as_user_or_fakeroot(cmd: str, env=None, stdout=None, stderr=None):
     """Usa fakeroot se existir, senão roda normalmente."""
     if which("fakeroot"):
-        return run_cmd(f"fakeroot sh -c '{cmd}'", shell=True, env=env, stdout=stdout, stderr=stderr)
+        # argv direto: o script não passa por mais uma camada de aspas
+        return run_cmd(["fakeroot", "sh", "-c", cmd], env=env, stdout=stdout, stderr=stderr)
     else:
         return run_cmd(cmd, shell=True, env=env, stdout=stdout, stderr=stderr)
 
-def strip_file(path: str):
-    if which("strip"):
+STRIP_BATCH = 1000   # arquivos por chamada de strip (folga para o ARG_MAX)
+
+def strip_files(paths: List[str]):
+    """Um único strip para vários arquivos (em lotes), em vez de um processo por arquivo."""
+    if not paths or not which("strip"):
+        return
+    it = iter(paths)
+    while True:
+        batch = list(itertools.islice(it, STRIP_BATCH))
+        if not batch:
+            break
         try:
-            run_cmd(["strip", "--strip-unneeded", path], check=False,
+            run_cmd(["strip", "--strip-unneeded", *batch], check=False,
                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         except Exception:
             pass
 
-def safe_relpath(path: str, start: str) -> str:
-    try:
-        return os.path.relpath(path, start)
-    except ValueError:
-        return path
+COPY_BUFSIZE = 1 << 20
+
+def _fast_copy(src: str, dst: str):
+    """Copia src -> dst no kernel (copy_file_range/sendfile) quando possível, preservando metadados."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        sfd, dfd = fsrc.fileno(), fdst.fileno()
+        done = 0
+        # copy_file_range: Linux >= 4.5; em btrfs/xfs vira reflink (CoW)
+        if hasattr(os, "copy_file_range"):
+            try:
+                while done < size:
+                    n = os.copy_file_range(sfd, dfd, size - done)
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                pass
+        if done < size and hasattr(os, "sendfile"):
+            try:
+                while done < size:
+                    n = os.sendfile(dfd, sfd, done, size - done)
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                pass
+        if done < size:
+            fsrc.seek(done)
+            fdst.seek(done)
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+    shutil.copystat(src, dst)
 
 # =============================
 # Modelos
 # =============================
 
 class Package:
-    def __init__(self, name, version, url, dependencies, commands, patches=None):
+    __slots__ = ("name", "version", "url", "dependencies", "commands", "patches", "sha256")
+
+    def __init__(self, name, version, url, dependencies, commands, patches=None, sha256=None):
         self.name = name
         self.version = version
         self.url = url
         self.dependencies = dependencies or []
         self.commands = commands or []
         self.patches = patches or []
+        self.sha256 = sha256                                  # opcional: sha256 do tarball da url
     def __repr__(self):
         return f"{self.name}-{self.version}"
 
@@ -136,74 +191,194 @@ class Package:
 # Recipe Manager + Index
 # =============================
 
+def _iter_recipes(root: str, dir_mtimes: Optional[Dict[str, int]] = None):
+    """Percorre root com os.scandir e gera os DirEntry de recipes (.yml/.yaml).
+    Se dir_mtimes for dado, registra nele o st_mtime_ns de cada diretório visitado."""
+    subdirs = []
+    try:
+        if dir_mtimes is not None:
+            # antes da listagem: mudanças durante a varredura invalidam o próximo load
+            dir_mtimes[root] = os.stat(root).st_mtime_ns
+        it = os.scandir(root)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith((".yml", ".yaml")):
+                yield entry
+    # arquivos do nível atual antes das subpastas (mesma ordem do os.walk)
+    for d in subdirs:
+        yield from _iter_recipes(d, dir_mtimes)
+
+# aliases PT/EN das chaves da recipe, na ordem de preferência
+_DEP_KEYS = ("dependências", "deps")
+_CMD_KEYS = ("comandos", "commands")
+
+def _first(d: dict, keys, default):
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return v
+    return default
+
+def _read_recipe(path: str) -> dict:
+    with open(path, "rb") as f:
+        return yaml.load(f, Loader=Loader) or {}
+
 class RecipeIndex:
+    # index.json: {"dir_mtimes": {diretório: st_mtime_ns} (RECIPES_DIR e todas as subpastas),
+    #              "entries": {nome: {"path": ..., "mtime": ..., "data": <recipe já parseada>}}}
     @staticmethod
-    def build_index() -> Dict[str, str]:
+    def build_index(previous: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+        """(Re)constrói o índice; só reparseia recipes cujo mtime mudou em relação a previous
+        (por padrão, o índice gravado em disco)."""
         idx = {}
         if not os.path.isdir(RECIPES_DIR):
             return idx
-        for root, _, files in os.walk(RECIPES_DIR):
-            for f in files:
-                if f.endswith(".yml") or f.endswith(".yaml"):
-                    name = f.rsplit(".", 1)[0]
-                    # Se houver duplicatas, a primeira encontrada prevalece
-                    idx.setdefault(name, os.path.join(root, f))
-        with open(RECIPE_INDEX, "w") as fp:
-            json.dump(idx, fp, indent=2)
+        if previous is None:
+            doc = RecipeIndex._read_index_file()
+            previous = doc["entries"] if doc else {}
+        dir_mtimes: Dict[str, int] = {}
+        for entry in _iter_recipes(RECIPES_DIR, dir_mtimes):
+            name = entry.name.rsplit(".", 1)[0]
+            # Se houver duplicatas, a primeira encontrada prevalece
+            if name in idx:
+                continue
+            mtime = entry.stat().st_mtime
+            old = previous.get(name)
+            if old and old.get("path") == entry.path and old.get("mtime") == mtime \
+                    and old.get("data") is not None:
+                idx[name] = old
+                continue
+            try:
+                data = _read_recipe(entry.path)
+            except yaml.YAMLError:
+                data = None
+            idx[name] = {"path": entry.path, "mtime": mtime, "data": data}
+        RecipeIndex.save_index(idx, dir_mtimes)
         return idx
 
     @staticmethod
-    def load_index() -> Dict[str, str]:
-        if not os.path.exists(RECIPE_INDEX):
-            return RecipeIndex.build_index()
+    def save_index(idx: Dict[str, dict], dir_mtimes: Dict[str, int]):
+        # escrita atômica: outro genpkg rodando nunca lê um índice pela metade
+        tmp = f"{RECIPE_INDEX}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fp:
+            json.dump({"dir_mtimes": dir_mtimes, "entries": idx}, fp, indent=2, default=str)
+        os.replace(tmp, RECIPE_INDEX)
+
+    @staticmethod
+    def update_entry(name: str, entry: dict):
+        """Regrava só a entrada de uma recipe editada no lugar (não muda o mtime do diretório)."""
+        doc = RecipeIndex._read_index_file()
+        if doc is None or not isinstance(doc.get("dir_mtimes"), dict):
+            return
+        doc["entries"][name] = entry
+        RecipeIndex.save_index(doc["entries"], doc["dir_mtimes"])
+
+    @staticmethod
+    def _read_index_file() -> Optional[dict]:
         try:
             with open(RECIPE_INDEX, "r") as fp:
-                return json.load(fp)
+                doc = json.load(fp)
         except Exception:
-            return RecipeIndex.build_index()
+            return None
+        # índice no formato antigo ({nome: caminho} ou sem "entries")
+        if not isinstance(doc, dict) or not isinstance(doc.get("entries"), dict):
+            return None
+        return doc
+
+    @staticmethod
+    def load_index() -> Dict[str, dict]:
+        doc = RecipeIndex._read_index_file()
+        if doc is None:
+            return RecipeIndex.build_index({})
+        # recipe criada/removida em qualquer subpasta muda o mtime daquele diretório
+        dir_mtimes = doc.get("dir_mtimes")
+        try:
+            if isinstance(dir_mtimes, dict) and dir_mtimes and \
+                    all(os.stat(d).st_mtime_ns == m for d, m in dir_mtimes.items()):
+                return doc["entries"]
+        except OSError:
+            pass
+        return RecipeIndex.build_index(doc["entries"])
 
 class RecipeManager:
     def __init__(self):
         self.index = RecipeIndex.load_index()
+        self._cache: Dict[str, Package] = {}   # recipes já carregadas nesta execução
 
     def reindex(self):
         self.index = RecipeIndex.build_index()
+        self._cache.clear()
 
     def _find_recipe_path(self, package_name: str) -> Optional[str]:
-        path = self.index.get(package_name)
-        if path and os.path.exists(path):
-            return path
+        entry = self.index.get(package_name)
+        if entry and os.path.exists(entry["path"]):
+            return entry["path"]
+        if entry:
+            # arquivo sumiu: cache inteiro está desatualizado
+            self.reindex()
+            entry = self.index.get(package_name)
+            if entry:
+                return entry["path"]
         # fallback: search recursively (em caso de cache desatualizado)
-        for root, _, files in os.walk(RECIPES_DIR):
-            for f in files:
-                if f == f"{package_name}.yml":
-                    return os.path.join(root, f)
+        target = f"{package_name}.yml"
+        for entry in _iter_recipes(RECIPES_DIR):
+            if entry.name == target:
+                return entry.path
         return None
 
+    def cached_version(self, package_name: str) -> Optional[str]:
+        """Versão da recipe a partir do índice (sem YAML); None se a entrada estiver desatualizada."""
+        entry = self.index.get(package_name)
+        if not entry or entry.get("data") is None:
+            return None
+        try:
+            if os.stat(entry["path"]).st_mtime != entry.get("mtime"):
+                return None
+        except OSError:
+            return None
+        return entry["data"].get("versão", "0")
+
     def load(self, package_name: str) -> Package:
+        cached = self._cache.get(package_name)
+        if cached is not None:
+            return cached
         recipe_path = self._find_recipe_path(package_name)
         if not recipe_path:
             raise FileNotFoundError(colored(f"⚠️ Receita {package_name} não encontrada em {RECIPES_DIR}.", Fore.RED))
-        with open(recipe_path, "r") as f:
-            data = yaml.safe_load(f) or {}
-        return Package(
+        entry = self.index.get(package_name)
+        mtime = os.stat(recipe_path).st_mtime
+        if (entry and entry["path"] == recipe_path and entry.get("data") is not None
+                and entry.get("mtime") == mtime):
+            data = entry["data"]
+        else:
+            data = _read_recipe(recipe_path)
+            # recipe editada no lugar: atualiza o índice para não reparsear em toda execução
+            entry = {"path": recipe_path, "mtime": mtime, "data": data}
+            self.index[package_name] = entry
+            RecipeIndex.update_entry(package_name, entry)
+        pkg = Package(
             data.get("nome", package_name),
             data.get("versão", "0"),
             data.get("url", ""),
-            data.get("dependências", []) or data.get("deps", []),
-            data.get("comandos", []) or data.get("commands", []),
+            _first(data, _DEP_KEYS, []),
+            _first(data, _CMD_KEYS, []),
             data.get("patches", []),
+            data.get("sha256"),
         )
+        self._cache[package_name] = pkg
+        return pkg
 
     def search(self, term: str) -> List[str]:
         term = term.lower()
         names = set(self.index.keys())
         # fallback: varrer se vazio
         if not names and os.path.isdir(RECIPES_DIR):
-            for root, _, files in os.walk(RECIPES_DIR):
-                for f in files:
-                    if f.endswith(".yml") or f.endswith(".yaml"):
-                        names.add(f.rsplit(".", 1)[0])
+            for entry in _iter_recipes(RECIPES_DIR):
+                names.add(entry.name.rsplit(".", 1)[0])
         return sorted([n for n in names if term in n.lower()])
 
 # =============================
@@ -230,44 +405,239 @@ class DB:
 # Downloader / Extractor
 # =============================
 
-def http_download(url: str, dest_dir: str) -> str:
-    import requests
+DOWNLOAD_CHUNK   = 1024 * 256
+DOWNLOAD_WORKERS = 8
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def _get_session():
+    """Session única por processo: reaproveita DNS/TLS/keep-alive entre downloads."""
+    global _SESSION
+    # as threads do prefetch chegam aqui juntas: sem o lock cada uma criaria sua Session
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                                  max_retries=Retry(total=3, backoff_factor=0.5,
+                                                    status_forcelist=[502, 503, 504]))
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION = session
+        return _SESSION
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):   # Python 3.11+
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
+        for block in iter(lambda: f.read(COPY_BUFSIZE), b""):
+            h.update(block)
+        return h.hexdigest()
+
+def _sha256_stamp(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size} {st.st_mtime_ns}"
+
+def _write_sha256(path: str, digest: str):
+    with open(path + ".sha256", "w") as fp:
+        fp.write(f"{digest} {_sha256_stamp(path)}\n")
+
+def cached_sha256(path: str) -> str:
+    """sha256 de path, reaproveitando <path>.sha256 enquanto tamanho/mtime não mudarem."""
+    try:
+        with open(path + ".sha256", "r") as fp:
+            digest, stamp = fp.read().strip().split(" ", 1)
+        if stamp == _sha256_stamp(path):
+            return digest
+    except (OSError, ValueError):
+        pass
+    digest = file_sha256(path)
+    _write_sha256(path, digest)
+    return digest
+
+def _cached_download_ok(filepath: str, sha256: Optional[str]) -> bool:
+    """True se filepath já existe e (quando há sha256 na recipe) confere."""
+    if not os.path.exists(filepath):
+        return False
+    if not sha256 or cached_sha256(filepath) == sha256.lower():
+        return True
+    print(colored(f"⚠️ {os.path.basename(filepath)} com sha256 diferente do esperado, baixando de novo.", Fore.YELLOW))
+    return False
+
+def _finish_download(partial: str, filepath: str, sha256: Optional[str], digest: str):
+    """digest: sha256 calculado durante o download (sem reler o arquivo)."""
+    if sha256 and digest != sha256.lower():
+        os.remove(partial)
+        raise RuntimeError(f"sha256 inválido para {os.path.basename(filepath)}: esperado {sha256}, obtido {digest}.")
+    # só aparece com o nome final quando completo (download interrompido não é reaproveitado)
+    os.replace(partial, filepath)
+    _write_sha256(filepath, digest)
+
+def http_download(url: str, dest_dir: str, show_spinner=True, sha256: Optional[str] = None) -> str:
     os.makedirs(dest_dir, exist_ok=True)
     filename = url.split("/")[-1]
     filepath = os.path.join(dest_dir, filename)
-    if os.path.exists(filepath):
+    if _cached_download_ok(filepath, sha256):
         return filepath
+    partial = filepath + ".partial"
     spinner = Spinner(f"📥 Baixando {filename}")
-    spinner.start()
+    if show_spinner:
+        spinner.start()
+    h = hashlib.sha256()
     try:
-        with requests.get(url, stream=True) as r:
+        with _get_session().get(url, stream=True) as r:
             r.raise_for_status()
-            with open(filepath, "wb") as f:
-                for chunk in r.iter_content(chunk_size=1024 * 64):
+            with open(partial, "wb") as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK):
                     if chunk:
+                        h.update(chunk)
                         f.write(chunk)
     finally:
-        spinner.stop()
+        if show_spinner:
+            spinner.stop()
+    _finish_download(partial, filepath, sha256, h.hexdigest())
+    return filepath
+
+ASYNC_CHUNK = 1 << 20
+ASYNC_RETRIES = 3               # mesma política do Retry da Session (requests)
+ASYNC_BACKOFF = 0.5
+ASYNC_RETRY_STATUS = (502, 503, 504)
+
+async def _async_download(session, url: str, dest_dir: str, sha256: Optional[str]) -> str:
+    import aiohttp
+    os.makedirs(dest_dir, exist_ok=True)
+    filepath = os.path.join(dest_dir, url.split("/")[-1])
+    # hash de arquivo inteiro fora do event loop: não trava as outras transferências
+    if await asyncio.to_thread(_cached_download_ok, filepath, sha256):
+        return filepath
+    partial = filepath + ".partial"
+    for attempt in range(ASYNC_RETRIES + 1):
+        h = hashlib.sha256()
+        try:
+            async with session.get(url) as r:
+                r.raise_for_status()
+                with open(partial, "wb") as f:
+                    async for chunk in r.content.iter_chunked(ASYNC_CHUNK):
+                        h.update(chunk)
+                        f.write(chunk)
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in ASYNC_RETRY_STATUS
+            if not retryable or attempt == ASYNC_RETRIES:
+                raise
+            await asyncio.sleep(ASYNC_BACKOFF * (2 ** attempt))
+    _finish_download(partial, filepath, sha256, h.hexdigest())
     return filepath
 
+async def _async_gather_downloads(jobs: List[Tuple[str, str, Optional[str]]]):
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=16)
+    # sem limite total (tarballs grandes podem levar mais de 5 min); só conexão/leitura parada
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+    # trust_env: HTTP(S)_PROXY/NO_PROXY/.netrc, como no caminho requests
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=True) as session:
+        await asyncio.gather(*(_async_download(session, url, d, sha) for url, d, sha in jobs))
+
+def _async_fetch_all(jobs: List[Tuple[str, str, Optional[str]]]):
+    """Todos os downloads num único event loop (aiohttp), sem uma thread por arquivo."""
+    asyncio.run(_async_gather_downloads(jobs))
+
+def prefetch_downloads(jobs: List[Tuple[str, str, Optional[str]]]):
+    """Baixa em paralelo os (url, dest_dir, sha256) que faltam: threads + a Session compartilhada,
+    ou um único event loop aiohttp com GENPKG_AIOHTTP=1 (e aiohttp instalado)."""
+    pending = [(url, d, sha) for url, d, sha in dict.fromkeys(jobs)
+               if url and (sha or not os.path.exists(os.path.join(d, url.split("/")[-1])))]
+    if not pending:
+        return
+    print(colored(f"📥 Baixando/verificando {len(pending)} arquivo(s)...", Fore.CYAN))
+    aiohttp = None
+    if USE_AIOHTTP:
+        try:
+            import aiohttp  # noqa: F401  (opcional)
+        except ImportError:
+            print(colored("⚠️ GENPKG_AIOHTTP=1, mas aiohttp não está instalado; usando requests.", Fore.YELLOW))
+    if aiohttp is not None:
+        _async_fetch_all(pending)
+        return
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        futures = [pool.submit(http_download, url, d, False, sha) for url, d, sha in pending]
+        for fut in futures:
+            fut.result()
+
+TAR_BUFSIZE = 1 << 20   # 1 MiB por leitura ao extrair
+
+# descompressores externos (paralelos/C) preferidos por sufixo
+DECOMPRESSORS = [
+    ((".tar.gz", ".tgz"), "pigz"),
+    ((".tar.xz",),        "xz"),
+    ((".tar.bz2",),       "pbzip2"),
+    ((".tar.zst",),       "zstd"),
+]
+
+def _external_decompressor(filepath: str) -> Optional[str]:
+    for suffixes, tool in DECOMPRESSORS:
+        if filepath.endswith(suffixes):
+            return which(tool)
+    return None
+
+def _extract_stream(filepath: str, outdir: str, mode: str):
+    """Leitura sequencial (sem seek) com buffer grande no arquivo e no tarfile."""
+    with open(filepath, "rb", buffering=TAR_BUFSIZE) as raw, \
+         tarfile.open(fileobj=raw, mode=mode, bufsize=TAR_BUFSIZE) as tar:
+        tar.extractall(path=outdir)
+
+def _extract_via_pipe(tool: str, filepath: str, outdir: str):
+    """Descomprime com ferramenta externa e lê o tar como stream (r|)."""
+    cmd = [tool, "-dc", filepath]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=TAR_BUFSIZE)
+    try:
+        with tarfile.open(fileobj=p.stdout, mode="r|", bufsize=TAR_BUFSIZE) as tar:
+            tar.extractall(path=outdir)
+    finally:
+        p.stdout.close()
+        ret = p.wait()
+    if ret != 0:
+        raise subprocess.CalledProcessError(ret, cmd)
+
+# compressores externos multi-thread para empacotar, em ordem de preferência
+COMPRESSORS = [
+    ("zstd", ".tar.zst", ["-q", "-T0", "-c"]),
+    ("pigz", ".tar.gz",  ["-c", "-p", str(os.cpu_count() or 1)]),
+]
+
+def _tar_via_pipe(cmd: List[str], srcdir: str, outfile: str):
+    """Gera o tar em stream (w|) direto no stdin do compressor externo."""
+    with open(outfile, "wb") as out:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+        try:
+            with tarfile.open(fileobj=p.stdin, mode="w|") as tar:
+                tar.add(srcdir, arcname=".")
+        finally:
+            p.stdin.close()
+            ret = p.wait()
+    if ret != 0:
+        raise subprocess.CalledProcessError(ret, cmd)
+
 def extract_tar_any(filepath: str, outdir: str) -> str:
     print(colored(f"📦 Extraindo {os.path.basename(filepath)}...", Fore.CYAN))
     os.makedirs(outdir, exist_ok=True)
     # Detect by suffix
-    if filepath.endswith((".tar.gz", ".tgz")):
-        mode = "r:gz"
-        with tarfile.open(filepath, mode) as tar:
-            tar.extractall(path=outdir)
+    tool = _external_decompressor(filepath)
+    if tool:
+        _extract_via_pipe(tool, filepath, outdir)
+    elif filepath.endswith((".tar.gz", ".tgz")):
+        _extract_stream(filepath, outdir, "r|gz")
     elif filepath.endswith(".tar.xz"):
-        with tarfile.open(fileobj=lzma.open(filepath), mode="r:") as tar:
-            tar.extractall(path=outdir)
+        _extract_stream(filepath, outdir, "r|xz")
     elif filepath.endswith(".tar.bz2"):
-        with tarfile.open(fileobj=bz2.BZ2File(filepath), mode="r:") as tar:
-            tar.extractall(path=outdir)
+        _extract_stream(filepath, outdir, "r|bz2")
     else:
-        # tentar abrir normalmente (tar sem compressão)
-        with tarfile.open(filepath, "r:") as tar:
-            tar.extractall(path=outdir)
+        # tentar abrir normalmente (tar sem compressão, ou detectar)
+        _extract_stream(filepath, outdir, "r|*")
     # tentativa: folder = nome do tar sem sufixos
     base = os.path.basename(filepath)
     dirname = (base
@@ -275,6 +645,7 @@ def extract_tar_any(filepath: str, outdir: str) -> str:
                .replace(".tgz", "")
                .replace(".tar.xz", "")
                .replace(".tar.bz2", "")
+               .replace(".tar.zst", "")
                .replace(".tar", ""))
     candidate = os.path.join(outdir, dirname)
     return candidate if os.path.isdir(candidate) else outdir
@@ -289,20 +660,30 @@ class Installer:
         self.recipes = recipes
         ensure_dirs()
 
-    def _apply_patches(self, pkg: Package, build_dir: str):
+    @staticmethod
+    def _apply_patches(pkg: Package, build_dir: str, show_spinner: bool = True):
         if not pkg.patches:
             return
+        # antes do pushd: PATCHES_DIR é relativo e o prefetch já baixou tudo em ./patches
+        patch_dir = os.path.abspath(PATCHES_DIR)
+        patch_files = [http_download(url, patch_dir, show_spinner) for url in pkg.patches]
         with pushd(build_dir):
-            for url in pkg.patches:
-                patch_file = http_download(url, PATCHES_DIR)
+            for patch_file in patch_files:
                 print(colored(f"🩹 Aplicando patch {os.path.basename(patch_file)}...", Fore.YELLOW))
                 run_cmd(f"patch -p1 < '{patch_file}'", shell=True)
 
-    def _run_build_commands(self, pkg: Package, build_dir: str, strip_binaries: bool) -> str:
+    @staticmethod
+    def _run_build_commands(pkg: Package, build_dir: str, strip_binaries: bool) -> str:
         destdir = os.path.abspath(os.path.join(DESTDIR_BASE, pkg.name))
         os.makedirs(destdir, exist_ok=True)
         env = os.environ.copy()
         env["DESTDIR"] = destdir
+        # paralelismo padrão para make/cmake/cargo (valores do usuário prevalecem);
+        # -l limita pela carga quando vários pacotes compilam ao mesmo tempo
+        jobs = str(os.cpu_count() or 1)
+        env.setdefault("MAKEFLAGS", f"-j{jobs} -l{jobs}")
+        env.setdefault("CMAKE_BUILD_PARALLEL_LEVEL", jobs)
+        env.setdefault("CARGO_BUILD_JOBS", jobs)
         env.update(CHROOT_ENV)
 
         log_path = os.path.join(LOGS_DIR, f"{pkg.name}.log")
@@ -311,79 +692,114 @@ class Installer:
         with open(log_path, "w") as log, pushd(build_dir):
             for cmd in pkg.commands:
                 print(colored(f"⚙️  {cmd}", Fore.GREEN))
-                run_shell_as_user_or_fakeroot(cmd, env=env, stdout=log, stderr=log)
+            # um único shell para a recipe inteira: cd/export valem para os passos seguintes.
+            # `set -e` não basta (ignora falhas no meio de `a && b`): cada linha aborta com o seu status;
+            # `set -x` registra no log qual passo falhou.
+            if pkg.commands:
+                script = "set -x\n" + "".join(f"{{ {cmd}\n}} || exit $?\n" for cmd in pkg.commands)
+                run_shell_as_user_or_fakeroot(script, env=env, stdout=log, stderr=log)
 
             if strip_binaries:
                 print(colored("🔪 Strip dos binários...", Fore.MAGENTA))
                 usr_bin = os.path.join(destdir, "usr", "bin")
                 usr_sbin = os.path.join(destdir, "usr", "sbin")
+                targets = []
                 for root_dir in [usr_bin, usr_sbin]:
                     if os.path.isdir(root_dir):
-                        for name in os.listdir(root_dir):
-                            strip_file(os.path.join(root_dir, name))
+                        with os.scandir(root_dir) as it:
+                            targets.extend(e.path for e in it
+                                           if e.is_file() and os.access(e.path, os.X_OK))
+                strip_files(targets)
         return destdir
 
-    def _package_destdir_to_tar_gz(self, pkg: Package, destdir: str) -> str:
-        pkgfile = os.path.join(PACKAGES_DIR, f"{pkg.name}-{pkg.version}.tar.gz")
+    @staticmethod
+    def _package_destdir_to_tar_gz(pkg: Package, destdir: str) -> str:
+        base = os.path.join(PACKAGES_DIR, f"{pkg.name}-{pkg.version}")
+        for tool, suffix, args in COMPRESSORS:
+            path = which(tool)
+            if path:
+                pkgfile = base + suffix
+                print(colored(f"📦 Empacotando {pkgfile}...", Fore.MAGENTA))
+                _tar_via_pipe([path, *args], destdir, pkgfile)
+                return pkgfile
+        # fallback: gzip do Python (single-thread)
+        pkgfile = base + ".tar.gz"
         print(colored(f"📦 Empacotando {pkgfile}...", Fore.MAGENTA))
         with tarfile.open(pkgfile, "w:gz") as tar:
             tar.add(destdir, arcname=".")
         return pkgfile
 
-    def _copy_binaries_to_bindir(self, destdir: str) -> List[str]:
+    @staticmethod
+    def _copy_binaries_to_bindir(destdir: str) -> List[str]:
         copied = []
         for sub in ["usr/bin", "bin", "sbin", "usr/sbin"]:
             src = os.path.join(destdir, sub)
             if os.path.isdir(src):
                 os.makedirs(BIN_DIR, exist_ok=True)
-                for f in os.listdir(src):
-                    s = os.path.join(src, f)
-                    if os.path.isfile(s) and os.access(s, os.X_OK):
-                        d = os.path.join(BIN_DIR, f)
-                        shutil.copy2(s, d)
-                        copied.append(d)
-                        print(colored(f"👉 Binário disponível: {d}", Fore.GREEN))
+                with os.scandir(src) as it:
+                    for entry in it:
+                        if entry.is_file() and os.access(entry.path, os.X_OK):
+                            d = os.path.join(BIN_DIR, entry.name)
+                            _fast_copy(entry.path, d)
+                            copied.append(d)
+                            print(colored(f"👉 Binário disponível: {d}", Fore.GREEN))
         return copied
 
-    def _collect_file_list(self, destdir: str) -> List[str]:
+    @staticmethod
+    def _collect_file_list(destdir: str) -> List[str]:
+        destdir = destdir.rstrip(os.sep)
+        cut = len(destdir) + 1
         files = []
-        for root, _, names in os.walk(destdir):
-            for n in names:
-                abspath = os.path.join(root, n)
-                rel = safe_relpath(abspath, destdir)
-                files.append(rel)
+        stack = [destdir]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    # mesmo critério do os.walk: link p/ diretório conta como diretório, mas não é seguido
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            stack.append(entry.path)
+                    else:
+                        files.append(entry.path[cut:])
         return sorted(files)
 
-    def _install_core(self, pkg: Package, strip_binaries: bool) -> None:
+    @staticmethod
+    def _build_package(pkg: Package, strip_binaries: bool, show_spinner: bool = True) -> dict:
+        """Baixa, compila e empacota; devolve a entrada da DB (sem gravá-la).
+        Estático: roda também em processos filhos sem levar o Installer (DB, recipes) junto."""
         # download + extract
         if not pkg.url:
             raise RuntimeError(f"URL ausente na recipe de {pkg.name}.")
-        tarball = http_download(pkg.url, SOURCES_DIR)
+        tarball = http_download(pkg.url, SOURCES_DIR, show_spinner, sha256=pkg.sha256)
         build_dir = extract_tar_any(tarball, SOURCES_DIR)
 
         # patches + build
-        self._apply_patches(pkg, build_dir)
+        Installer._apply_patches(pkg, build_dir, show_spinner)
         spinner = Spinner(f"🔨 Compilando/instalando {pkg}")
-        spinner.start()
+        if show_spinner:
+            spinner.start()
         try:
-            destdir = self._run_build_commands(pkg, build_dir, strip_binaries)
+            destdir = Installer._run_build_commands(pkg, build_dir, strip_binaries)
         finally:
             spinner.stop()
 
-        pkgfile = self._package_destdir_to_tar_gz(pkg, destdir)
-        bin_copied = self._copy_binaries_to_bindir(destdir)
-        files = self._collect_file_list(destdir)
-
-        # registrar
-        self.db.data[pkg.name] = {
+        pkgfile = Installer._package_destdir_to_tar_gz(pkg, destdir)
+        bin_copied = Installer._copy_binaries_to_bindir(destdir)
+        files = Installer._collect_file_list(destdir)
+        return {
             "version": pkg.version,
             "files": files,
             "package_file": pkgfile,
             "destdir": os.path.relpath(destdir, "."),
             "bin_files": bin_copied
         }
+
+    def _register(self, pkg: Package, meta: dict):
+        self.db.data[pkg.name] = meta
         self.db.save()
-        print(colored(f"🎉 {pkg} instalado em {destdir}", Fore.GREEN))
+        print(colored(f"🎉 {pkg} instalado em {meta['destdir']}", Fore.GREEN))
+
+    def _install_core(self, pkg: Package, strip_binaries: bool) -> None:
+        self._register(pkg, self._build_package(pkg, strip_binaries))
 
     def _install_with_deps(self, pkg: Package, visited: Optional[set], strip_binaries: bool):
         if visited is None:
@@ -404,17 +820,121 @@ class Installer:
             return
         self._install_core(pkg, strip_binaries)
 
+    def _resolve_graph(self, pkg: Package) -> Dict[str, Package]:
+        """Carrega o fecho de dependências ainda não instaladas de pkg."""
+        graph = {}
+        stack = [pkg]
+        while stack:
+            p = stack.pop()
+            if p.name in graph:
+                continue
+            graph[p.name] = p
+            for dep_name in p.dependencies:
+                if dep_name not in graph and dep_name not in self.db.data:
+                    stack.append(self.recipes.load(dep_name))
+        return graph
+
+    @staticmethod
+    def _topo_layers(graph: Dict[str, Package]) -> Tuple[List[List[str]], List[str]]:
+        """Kahn em camadas: cada camada só depende das anteriores.
+        Os nomes que sobram estão em (ou dependem de) um ciclo."""
+        indegree = {}
+        dependents: Dict[str, List[str]] = {n: [] for n in graph}
+        for n, p in graph.items():
+            deps = {d for d in p.dependencies if d in graph}
+            indegree[n] = len(deps)
+            for d in deps:
+                dependents[d].append(n)
+        layers = []
+        layer = sorted(n for n, k in indegree.items() if k == 0)
+        while layer:
+            layers.append(layer)
+            nxt = []
+            for n in layer:
+                for m in dependents[n]:
+                    indegree[m] -= 1
+                    if indegree[m] == 0:
+                        nxt.append(m)
+            layer = sorted(nxt)
+        cyclic = sorted(n for n, k in indegree.items() if k > 0)
+        return layers, cyclic
+
+    @staticmethod
+    def _source_batches(todo: List[Package]) -> List[List[Package]]:
+        """Divide uma camada em lotes sem dois pacotes do mesmo tarball (mesmo sources/<arquivo>
+        e mesmo diretório de build): recipes multi-passe não extraem/compilam na mesma árvore ao mesmo tempo."""
+        batches: List[Tuple[set, List[Package]]] = []
+        for p in todo:
+            key = p.url.split("/")[-1]
+            for keys, batch in batches:
+                if key not in keys:
+                    keys.add(key)
+                    batch.append(p)
+                    break
+            else:
+                batches.append(({key}, [p]))
+        return [batch for _, batch in batches]
+
+    def _install_parallel(self, pkg: Package, strip_binaries: bool):
+        graph = self._resolve_graph(pkg)
+        layers, cyclic = self._topo_layers(graph)
+        # todas as fontes e patches de uma vez, antes de compilar
+        jobs = []
+        for p in graph.values():
+            if p.name not in self.db.data:
+                jobs.append((p.url, SOURCES_DIR, p.sha256))
+                jobs.extend((u, PATCHES_DIR, None) for u in p.patches)
+        prefetch_downloads(jobs)
+        # pool só é criado na primeira camada com mais de um pacote
+        pool = None
+        try:
+            for layer in layers:
+                todo = []
+                for n in layer:
+                    if n in self.db.data:
+                        print(colored(f"✅ {graph[n]} já instalado.", Fore.BLUE))
+                    else:
+                        todo.append(graph[n])
+                for batch in self._source_batches(todo):
+                    if len(batch) == 1:
+                        self._install_core(batch[0], strip_binaries)
+                        continue
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+                    futures = [pool.submit(_build_package_job, p, strip_binaries) for p in batch]
+                    wait(futures)
+                    # só o processo principal grava a DB
+                    errors = []
+                    for p, fut in zip(batch, futures):
+                        try:
+                            self._register(p, fut.result())
+                        except Exception as e:
+                            errors.append(e)
+                    if errors:
+                        raise errors[0]
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        # ciclos: caminho serial de sempre
+        visited = {n for layer in layers for n in layer}
+        for n in cyclic:
+            self._install_with_deps(graph[n], visited, strip_binaries)
+
     # API pública
 
     def install(self, name: str, strip_binaries: bool):
+        meta = self.db.data.get(name)
+        if meta is not None and meta.get("version") == self.recipes.cached_version(name):
+            print(colored(f"✅ {name}-{meta['version']} já instalado.", Fore.BLUE))
+            return
         pkg = self.recipes.load(name)
-        self._install_with_deps(pkg, visited=set(), strip_binaries=strip_binaries)
+        self._install_parallel(pkg, strip_binaries=strip_binaries)
 
     def build_only(self, name: str, strip_binaries: bool):
         """Compila e empacota no DESTDIR, mas não registra como instalado."""
         pkg = self.recipes.load(name)
         # somente core, sem deps e sem registrar na DB
-        tarball = http_download(pkg.url, SOURCES_DIR)
+        tarball = http_download(pkg.url, SOURCES_DIR, sha256=pkg.sha256)
         build_dir = extract_tar_any(tarball, SOURCES_DIR)
         self._apply_patches(pkg, build_dir)
         spinner = Spinner(f"🔨 Compilando {pkg} (build-only)")
@@ -489,13 +1009,14 @@ class Installer:
             if not self.db.data:
                 print(colored("Nada instalado para recompilar.", Fore.YELLOW))
                 return
-            # compilar novamente todos os instalados (na ordem simples)
-            pkgs = list(self.db.data.keys())
-            for p in pkgs:
+            # compilar novamente todos os instalados, dependências antes dos dependentes;
+            # cada recipe é carregada uma vez e não há recursão de deps por pacote
+            pkgs = {n: self.recipes.load(n) for n in self.db.data}
+            layers, cyclic = self._topo_layers(pkgs)
+            for p in [n for layer in layers for n in layer] + cyclic:
                 print(colored(f"🔄 Recompilando {p}...", Fore.CYAN))
-                # remover antes? Vamos recompilar por cima do destdir (limpo)
                 self.remove(p)
-                self.install(p, strip_binaries)
+                self._install_core(pkgs[p], strip_binaries)
         else:
             if not name:
                 print(colored("Especifique um pacote ou use --all.", Fore.RED))
@@ -505,6 +1026,10 @@ class Installer:
                 self.remove(name)
             self.install(name, strip_binaries)
 
+def _build_package_job(pkg: Package, strip_binaries: bool) -> dict:
+    """Job do ProcessPool: só (pkg, strip) são serializados; sem spinner (vários processos, um TTY)."""
+    return Installer._build_package(pkg, strip_binaries, show_spinner=False)
+
 # =============================
 # Git sync & clean & reindex
 # =============================
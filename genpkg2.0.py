@@ -8,7 +8,7 @@
  Funcionalidades principais
  -------------------------
  • Variáveis/diretórios base: REPO, RECIPES, SOURCES, PATCHES, DESTDIR, PACKAGES, LOGS, BIN_DIR
- • Download via HTTPS (requests se disponível; fallback wget/curl) e suporte a git (git+https)
+ • Download via HTTPS (requests se disponível; fallback wget/curl), com `sha256:` opcional na recipe, e suporte a git (git+https, com #ref opcional; clones rasos)
  • Aplicação de patches (lista de URLs HTTPS) com `patch` (sistema)
  • Build com comandos definidos pela recipe (qualquer buildsystem)
  • DESTDIR + (opcional) fakeroot
@@ -36,18 +36,24 @@
   - Extrair/instalar em "/" requer permissões de root. Execute com sudo OU use --root ./rootfs para testar sem root.
 """
 from __future__ import annotations
+import io
 import os
+import hashlib
 import sys
 import json
 import tarfile
 import shutil
+import stat
+import tempfile
 import time
 import threading
 import itertools
 import argparse
 import subprocess
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 # ====== Cores ANSI simples (sem dependências externas) ======
 class Color:
@@ -66,6 +72,7 @@ BASE_DIR = Path(os.environ.get("GENPKG_BASE", Path.cwd()))
 REPO_DIR = Path(os.environ.get("REPO", BASE_DIR / "repo"))
 RECIPES_DIR = REPO_DIR / "recipes"
 RECIPE_INDEX = REPO_DIR / "index.json"
+RECIPE_CACHE_DIR = REPO_DIR / ".cache"                     # recipes já parseadas (JSON)
 SOURCES_DIR = Path(os.environ.get("SOURCES", BASE_DIR / "sources"))
 PATCHES_DIR = Path(os.environ.get("PATCHES", BASE_DIR / "patches"))
 DESTDIR_BASE = Path(os.environ.get("DESTDIR", BASE_DIR / "destdir"))
@@ -79,6 +86,18 @@ EMPTY_ICON = "[ ]"
 
 ALLOWED_REMOVE_PREFIXES = ["/usr", "/etc", "/var", "/opt", "/bin", "/sbin", "/lib", "/lib64", "/usr/local"]
 
+COPY_BUFSIZE = 2 * 1024 * 1024   # buffer de cópia (tarfile, binários, downloads)
+
+# tarfile copia o conteúdo dos membros em blocos de 16 KiB; forçamos blocos de 2 MiB.
+# (o `length` do copyfileobj do tarfile é o tamanho total, não o do bloco, por isso não
+# dá para trocar direto por shutil.copyfileobj)
+_tar_copyfileobj = tarfile.copyfileobj
+
+def _tar_copyfileobj_big(src, dst, length=None, exception=OSError, bufsize=None):
+    return _tar_copyfileobj(src, dst, length, exception, COPY_BUFSIZE)
+
+tarfile.copyfileobj = _tar_copyfileobj_big
+
 # ====== util ======
 def ensure_dirs():
     for d in [REPO_DIR, RECIPES_DIR, SOURCES_DIR, PATCHES_DIR, DESTDIR_BASE, PACKAGES_DIR, LOGS_DIR, BIN_DIR]:
@@ -96,34 +115,56 @@ def run_cmd(cmd: List[str] | str, *, cwd: Optional[Path]=None, env=None, check=T
 class Spinner:
     def __init__(self, message: str="Processando..."):
         self.message = message
+        self.tty = sys.stdout.isatty()
         self._stop = threading.Event()
         self._thread: Optional[threading.Thread] = None
-        self.frames = itertools.cycle(['⠋','⠙','⠹','⠸','⠼','⠴','⠦','⠧','⠇','⠏'])
+        # quadros já coloridos: um único write por tick
+        self._rendered = ["\r" + c(f"{message} {ch}", Color.YELLOW) for ch in '⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏']
 
     def start(self):
+        if not self.tty:
+            return
         def spin():
+            frames = itertools.cycle(self._rendered)
+            write, flush = sys.stdout.write, sys.stdout.flush
             while not self._stop.is_set():
-                sys.stdout.write("\r" + c(self.message + " " + next(self.frames), Color.YELLOW))
-                sys.stdout.flush()
-                time.sleep(0.1)
+                write(next(frames))
+                flush()
+                self._stop.wait(0.1)
         self._thread = threading.Thread(target=spin, daemon=True)
         self._thread.start()
 
     def stop(self):
-        if self._thread:
-            self._stop.set()
-            self._thread.join()
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join()
         sys.stdout.write("\r" + " " * 80 + "\r")
         sys.stdout.flush()
 
 
 # ====== Recipes ======
+_LOADER = None
+
+def _yaml_loader():
+    """CSafeLoader (libyaml) quando disponível; senão SafeLoader, com aviso único."""
+    global _LOADER
+    if _LOADER is None:
+        try:
+            from yaml import CSafeLoader as _LOADER
+        except ImportError:
+            from yaml import SafeLoader as _LOADER
+            print(c("Dica: PyYAML sem libyaml; instale libyaml-dev e reinstale pyyaml para leitura mais rápida.", Color.YELLOW))
+    return _LOADER
+
+
 class Recipe:
     def __init__(self, data: dict, path: Path):
         # Aceita chaves em PT/EN
         self.name = data.get("nome") or data.get("name")
         self.version = str(data.get("versão") or data.get("version") or "0")
         self.url = data.get("url") or ""
+        self.sha256: Optional[str] = (data.get("sha256") or "").lower() or None
         self.deps: List[str] = data.get("dependências") or data.get("deps") or []
         self.commands: List[str] = data.get("comandos") or data.get("commands") or []
         self.patches: List[str] = data.get("patches") or []
@@ -137,20 +178,48 @@ class Recipe:
             raise ValueError(f"Recipe {path} sem 'nome'.")
 
 
+def iter_recipe_files(root: Path, dir_mtimes: Optional[Dict[str, int]] = None):
+    """os.scandir recursivo: gera os DirEntry de .yml/.yaml (arquivos do nível antes das subpastas).
+    Se dir_mtimes for dado, registra nele o st_mtime_ns de cada diretório visitado."""
+    subdirs: List[str] = []
+    try:
+        if dir_mtimes is not None:
+            # mtime lido antes da listagem: mudança durante a varredura invalida o índice
+            dir_mtimes[str(root)] = os.stat(root).st_mtime_ns
+        it = os.scandir(root)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith((".yml", ".yaml")) and entry.is_file(follow_symlinks=False):
+                yield entry
+    for d in subdirs:
+        yield from iter_recipe_files(d, dir_mtimes)
+
+
 class RecipeIndex:
+    # index.json: {"dir_mtimes": {diretório: mtime_ns}, "recipes": {nome: caminho}}
+    # Criar/remover/renomear uma recipe muda o mtime do diretório que a contém.
     @staticmethod
     def build() -> Dict[str, str]:
         index: Dict[str, str] = {}
         if not RECIPES_DIR.exists():
             return index
-        for root, _, files in os.walk(RECIPES_DIR):
-            for f in files:
-                if f.endswith((".yml", ".yaml")):
-                    name = f.rsplit(".", 1)[0]
-                    index.setdefault(name, str(Path(root) / f))
+        dir_mtimes: Dict[str, int] = {}
+        for entry in iter_recipe_files(RECIPES_DIR, dir_mtimes):
+            index.setdefault(entry.name.rsplit(".", 1)[0], entry.path)
         RECIPE_INDEX.parent.mkdir(parents=True, exist_ok=True)
-        with open(RECIPE_INDEX, "w", encoding="utf-8") as fp:
-            json.dump(index, fp, indent=2, ensure_ascii=False)
+        # escrita atômica: nunca deixar um index.json pela metade
+        fd, tmp = tempfile.mkstemp(dir=str(RECIPE_INDEX.parent), prefix=".index.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump({"dir_mtimes": dir_mtimes, "recipes": index}, fp, indent=2, ensure_ascii=False)
+            os.replace(tmp, RECIPE_INDEX)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
         return index
 
     @staticmethod
@@ -159,9 +228,18 @@ class RecipeIndex:
             return RecipeIndex.build()
         try:
             with open(RECIPE_INDEX, "r", encoding="utf-8") as fp:
-                return json.load(fp)
+                doc = json.load(fp)
+            # nenhum diretório de recipes mudou desde o build: usa o índice sem varrer
+            # (só um stat por diretório, sem listar nem ler arquivos)
+            if all(os.stat(d).st_mtime_ns == m for d, m in doc["dir_mtimes"].items()):
+                return doc["recipes"]
         except Exception:
-            return RecipeIndex.build()
+            pass
+        return RecipeIndex.build()
+
+
+def clear_recipe_cache():
+    shutil.rmtree(RECIPE_CACHE_DIR, ignore_errors=True)
 
 
 class Recipes:
@@ -170,6 +248,7 @@ class Recipes:
 
     def reindex(self):
         self.index = RecipeIndex.build()
+        clear_recipe_cache()
 
     def find(self, name: str) -> Recipe:
         path = self.index.get(name)
@@ -184,19 +263,45 @@ class Recipes:
                     break
         if not path:
             raise FileNotFoundError(f"Receita '{name}' não encontrada em {RECIPES_DIR}.")
+        return Recipe(self._load_data(Path(path)), Path(path))
+
+    @staticmethod
+    def _cache_path(path: Path) -> Path:
+        try:
+            rel = path.relative_to(RECIPES_DIR)
+        except ValueError:
+            rel = Path(path.name)
+        return RECIPE_CACHE_DIR / (str(rel) + ".cache.json")
+
+    def _load_data(self, path: Path) -> dict:
+        """Dados da recipe via cache JSON (válido enquanto tamanho/mtime do YAML não mudarem)."""
+        st = path.stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        cache_path = self._cache_path(path)
+        try:
+            with open(cache_path, "r", encoding="utf-8") as fp:
+                cached = json.load(fp)
+            if cached.get("stamp") == stamp:
+                return cached["data"]
+        except (OSError, ValueError, KeyError):
+            pass
         import yaml  # garantimos erro claro se faltar
-        with open(path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
-        return Recipe(data, Path(path))
+        with open(path, "rb") as f:
+            data = yaml.load(f, Loader=_yaml_loader()) or {}
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as fp:
+                json.dump({"stamp": stamp, "data": data}, fp, ensure_ascii=False, default=str)
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass  # cache é só otimização
+        return data
 
     def search(self, term: str) -> List[str]:
+        # o índice já vem revalidado por RecipeIndex.load(); não varre RECIPES_DIR de novo
         term = term.lower()
-        names = set(self.index.keys())
-        for root, _, files in os.walk(RECIPES_DIR):
-            for f in files:
-                if f.endswith((".yml", ".yaml")):
-                    names.add(f.rsplit(".",1)[0])
-        return sorted([n for n in names if term in n.lower()])
+        return sorted(n for n in self.index if term in n.lower())
 
 
 # ====== Database ======
@@ -204,6 +309,8 @@ class DB:
     def __init__(self, path: Path = DB_PATH):
         self.path = path
         self.data: Dict[str, dict] = self._load()
+        self.batching = False
+        self.dirty = False
 
     def _load(self) -> Dict[str, dict]:
         if not self.path.exists():
@@ -214,66 +321,262 @@ class DB:
         except Exception:
             return {}
 
-    def save(self):
-        with open(self.path, "w", encoding="utf-8") as fp:
-            json.dump(self.data, fp, indent=2, ensure_ascii=False)
+    def save(self, force: bool = False):
+        """Grava installed.json; dentro de batch() só marca como sujo (gravação no fim)."""
+        if self.batching and not force:
+            self.dirty = True
+            return
+        payload = json.dumps(self.data, ensure_ascii=False, separators=(",", ":"))
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(payload, encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    @contextmanager
+    def batch(self):
+        """Adia as gravações de várias operações para uma única ao final."""
+        prev = self.batching
+        self.batching = True
+        try:
+            yield self
+        finally:
+            self.batching = prev
+            if not prev and self.dirty:
+                self.save(force=True)
 
 
 # ====== Download/Extract/Patch ======
-def http_download(url: str, dest_dir: Path) -> Path:
+_DOWNLOAD_LOCKS: Dict[str, threading.Lock] = {}
+_DOWNLOAD_LOCKS_GUARD = threading.Lock()
+
+
+def _download_lock(key: str) -> threading.Lock:
+    with _DOWNLOAD_LOCKS_GUARD:
+        return _DOWNLOAD_LOCKS.setdefault(key, threading.Lock())
+
+
+def http_download(url: str, dest_dir: Path, *, spinner: bool = True, sha256: Optional[str] = None) -> Path:
     dest_dir.mkdir(parents=True, exist_ok=True)
     filename = url.split("/")[-1]
     out = dest_dir / filename
-    if out.exists():
-        return out
+    # um download por arquivo de destino, mesmo com várias threads pedindo o mesmo
+    with _download_lock(str(out)):
+        if out.exists():
+            # cache sem sha256 na recipe é aceito como está; com sha256, confere (via <arquivo>.sha256)
+            if not sha256 or _cached_sha256(out) == sha256:
+                return out
+            print(c(f"⚠️ {filename} com sha256 diferente do esperado, baixando de novo.", Color.YELLOW))
+        _http_fetch(url, out, filename, spinner, sha256)
+    return out
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def _http_session():
+    """Session única (keep-alive, pool de 16 conexões, retry em 502/503/504); requests é opcional."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                                  max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION = session
+        return _SESSION
+
+
+class _HashingWriter:
+    """Arquivo de saída que alimenta o hash a cada bloco escrito (sem reler o arquivo depois)."""
+    def __init__(self, f, h):
+        self.f, self.h = f, h
+
+    def write(self, b):
+        self.h.update(b)
+        return self.f.write(b)
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFSIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _sha256_stamp(path: Path) -> List[int]:
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _write_sha256(path: Path, digest: str):
+    sidecar = path.with_name(path.name + ".sha256")
+    with open(sidecar, "w", encoding="utf-8") as fp:
+        json.dump({"sha256": digest, "stamp": _sha256_stamp(path)}, fp)
+
+
+def _sidecar_sha256(path: Path) -> Optional[str]:
+    """Digest guardado em <path>.sha256, se ainda válido para o tamanho/mtime atuais (sem ler path)."""
+    sidecar = path.with_name(path.name + ".sha256")
+    try:
+        with open(sidecar, "r", encoding="utf-8") as fp:
+            doc = json.load(fp)
+        if doc["stamp"] == _sha256_stamp(path):
+            return doc["sha256"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _cached_sha256(path: Path) -> str:
+    """sha256 de path, reaproveitando <path>.sha256 enquanto tamanho/mtime não mudarem."""
+    digest = _sidecar_sha256(path)
+    if digest is not None:
+        return digest
+    digest = _file_sha256(path)
+    _write_sha256(path, digest)
+    return digest
+
+
+def _http_fetch(url: str, out: Path, filename: str, show_spinner: bool, sha256: Optional[str] = None):
     spinner = Spinner(f"Baixando {filename}")
-    spinner.start()
+    if show_spinner:
+        spinner.start()
+    # baixa para .part e renomeia no fim: download interrompido nunca vira cache válido
+    part = out.with_name(out.name + ".part")
+    digest: Optional[str] = None
     try:
         try:
-            import requests
-            with requests.get(url, stream=True) as r:
+            with _http_session().get(url, stream=True, timeout=(5, 60),
+                                     headers={"Accept-Encoding": "identity"}) as r:
                 r.raise_for_status()
-                with open(out, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=1024*128):
-                        if chunk:
-                            f.write(chunk)
+                r.raw.decode_content = True
+                h = hashlib.sha256()
+                with open(part, "wb", buffering=COPY_BUFSIZE) as f:
+                    shutil.copyfileobj(r.raw, _HashingWriter(f, h), COPY_BUFSIZE)
+                digest = h.hexdigest()
         except Exception:
+            digest = None
             # fallback wget/curl
             if which("wget"):
-                run_cmd(["wget", "-O", str(out), url])
+                run_cmd(["wget", "-O", str(part), url])
             elif which("curl"):
-                run_cmd(["curl", "-L", "-o", str(out), url])
+                run_cmd(["curl", "-L", "-o", str(part), url])
             else:
                 raise RuntimeError("Instale 'requests' ou tenha 'wget'/'curl' no sistema para baixar arquivos.")
+        if sha256:
+            if digest is None:  # veio do wget/curl
+                digest = _file_sha256(part)
+            if digest != sha256:
+                part.unlink(missing_ok=True)
+                raise RuntimeError(f"sha256 não confere para {filename}: esperado {sha256}, obtido {digest}")
+        os.replace(part, out)
+        if digest is not None:
+            _write_sha256(out, digest)
     finally:
-        spinner.stop()
-    return out
+        if show_spinner:
+            spinner.stop()
+
+
+def download_all(jobs: List[Tuple[str, Path, Optional[str]]]):
+    """Baixa em paralelo (threads) as triplas (url, dest_dir, sha256) que faltam; cada arquivo só uma vez."""
+    def cached(url: str, d: Path, sha256: Optional[str]) -> bool:
+        out = d / url.split("/")[-1]
+        # sem sidecar válido, http_download (na thread) é quem confere o sha256
+        return out.exists() and (not sha256 or _sidecar_sha256(out) == sha256)
+    jobs = [job for job in dict.fromkeys(jobs) if not cached(*job)]
+    if not jobs:
+        return
+    print(c(f"📥 Baixando {len(jobs)} arquivo(s) em paralelo…", Color.CYAN))
+    with ThreadPoolExecutor(max_workers=min(16, len(jobs))) as ex:
+        futures = [ex.submit(http_download, url, d, spinner=False, sha256=h) for url, d, h in jobs]
+        for f in futures:
+            f.result()
+
 
+def split_git_ref(git_url: str) -> Tuple[str, Optional[str]]:
+    """Separa 'url#ref' em (url, ref); sem '#' o ref é None (HEAD remoto)."""
+    url, _, ref = git_url.partition("#")
+    return url, (ref or None)
 
-def git_download(git_url: str, dest_dir: Path) -> Path:
+
+def git_download(git_url: str, dest_dir: Path, ref: Optional[str] = None) -> Path:
+    # Clone raso: para compilar só precisamos da árvore do commit pedido.
     if not which("git"):
         raise RuntimeError("'git' não encontrado no sistema.")
     dest_dir.mkdir(parents=True, exist_ok=True)
     folder = dest_dir / (git_url.rsplit("/",1)[-1].replace(".git",""))
     if folder.exists():
-        run_cmd(["git", "-C", str(folder), "fetch", "--all", "-p"])
-        run_cmd(["git", "-C", str(folder), "reset", "--hard", "origin/HEAD"], check=False)
+        run_cmd(["git", "-C", str(folder), "fetch", "--depth=1", "origin", ref or "HEAD"])
+        run_cmd(["git", "-C", str(folder), "reset", "--hard", "FETCH_HEAD"], check=False)
+    elif ref:
+        # ref qualquer (branch, tag ou SHA de commit): `clone --branch` não aceita SHA
+        run_cmd(["git", "init", "-q", str(folder)])
+        run_cmd(["git", "-C", str(folder), "remote", "add", "origin", git_url])
+        run_cmd(["git", "-C", str(folder), "fetch", "--depth=1", "origin", ref])
+        run_cmd(["git", "-C", str(folder), "checkout", "-q", "FETCH_HEAD"])
     else:
-        run_cmd(["git", "clone", git_url, str(folder)])
+        run_cmd(["git", "clone", "--depth=1", "--single-branch", git_url, str(folder)])
     return folder
 
 
+SYSTEM_TAR_MIN_SIZE = 4 * 1024 * 1024   # fontes acima disso: extrair com o tar do sistema
+
+
+def _use_system_tar(filepath: Path) -> bool:
+    return bool(which("tar")) and filepath.stat().st_size > SYSTEM_TAR_MIN_SIZE
+
+
+def system_tar_extract(filepath: Path, outdir: Path, *extra: str):
+    """Extrai com `tar -xf` (C, descompressão nativa). Só para fontes em SOURCES_DIR:
+    pacotes no root alvo passam pelo tarfile (symlinks de diretório, validação e lista de arquivos)."""
+    outdir.mkdir(parents=True, exist_ok=True)
+    run_cmd(["tar", *extra, "-xf", str(filepath), "-C", str(outdir)])
+
+
+def _tar_top_dir(filepath: Path) -> Optional[str]:
+    """Primeiro componente do primeiro nome listado por `tar -tf`; lê só o começo do arquivo."""
+    proc = subprocess.Popen(["tar", "-tf", str(filepath)], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in proc.stdout:
+            name = line.strip().lstrip("/")
+            while name.startswith("./"):
+                name = name[2:]
+            if name and name != ".":
+                return name.split("/", 1)[0]
+        return None
+    finally:
+        proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+
 def extract_tar_any(filepath: Path, outdir: Path) -> Path:
     outdir.mkdir(parents=True, exist_ok=True)
     print(c(f"📦 Extraindo {filepath.name}...", Color.CYAN))
+    if _use_system_tar(filepath):
+        # raiz vem do próprio tar: com o diretório já existente (rebuild/upgrade) não há o que comparar,
+        # e o mtime restaurado pelo tar não diz qual diretório é deste arquivo
+        top = _tar_top_dir(filepath)
+        system_tar_extract(filepath, outdir, "--no-same-owner")
+        root = outdir / top if top else None
+        return root if root is not None and root.is_dir() else outdir
     with tarfile.open(str(filepath), "r:*") as tar:
-        top_members = [m for m in tar.getmembers() if m.name and "/" not in m.name.strip("/")]
-        tar.extractall(path=str(outdir))
+        if hasattr(tarfile, "data_filter"):  # fonte baixada da internet: bloqueia caminhos absolutos e '..'
+            tar.extraction_filter = tarfile.data_filter
+        members = tar.getmembers()  # um único passe pelos cabeçalhos
+        tar.extractall(path=str(outdir), members=members)
     # Melhor tentativa de detectar diretório raiz
-    try:
-        roots = set(p.parts[0] for p in (Path(m.name) for m in tar.getmembers()) if m.name.strip())  # type: ignore
-    except Exception:
-        roots = set()
+    roots = {Path(m.name).parts[0] for m in members if m.name.strip("./")}
+    if len(roots) == 1:
+        root = outdir / roots.pop()
+        if root.is_dir():
+            return root
     # fallback: escolher o diretório mais recente criado
     candidates = sorted([p for p in outdir.iterdir() if p.is_dir()], key=lambda p: p.stat().st_mtime, reverse=True)
     return candidates[0] if candidates else outdir
@@ -284,10 +587,14 @@ def apply_patches(patch_urls: List[str], build_dir: Path):
         return
     if not which("patch"):
         raise RuntimeError("'patch' não encontrado no sistema.")
-    for url in patch_urls:
-        patch_file = http_download(url, PATCHES_DIR)
+    # 1) downloads em paralelo; 2) aplicação em série, na ordem da recipe
+    with ThreadPoolExecutor(max_workers=min(16, len(patch_urls))) as ex:
+        patch_files = list(ex.map(lambda u: http_download(u, PATCHES_DIR, spinner=False), patch_urls))
+    for patch_file in patch_files:
         print(c(f"🩹 Aplicando patch {patch_file.name}...", Color.MAGENTA))
-        run_cmd(f"patch -p1 < '{patch_file}'", cwd=build_dir, check=True)
+        # sem shell: o próprio Python redireciona o patch para o stdin
+        with open(patch_file, "rb") as pf:
+            subprocess.run(["patch", "-p1"], stdin=pf, cwd=str(build_dir), check=True)
 
 
 # ====== Execução de comandos de build com log e spinner ======
@@ -308,26 +615,38 @@ def run_logged(cmd: str, *, cwd: Path, log_file: Path, env=None):
 
 
 # ====== Build/Package/Install ======
+STRIP_BATCH = 1000
+
+
 def strip_binaries_in(destdir: Path):
     if not which("strip"):
         return
-    for sub in ["usr/bin", "usr/sbin", "bin", "sbin"]:
-        d = destdir / sub
-        if d.is_dir():
-            for f in d.iterdir():
-                try:
-                    run_cmd(["strip", "--strip-unneeded", str(f)], check=False)
-                except Exception:
-                    pass
+    targets = [str(f) for sub in ("usr/bin", "usr/sbin", "bin", "sbin")
+               if (destdir / sub).is_dir()
+               for f in (destdir / sub).iterdir() if f.is_file()]
+    # um strip para vários arquivos (em lotes, por causa do ARG_MAX) em vez de um fork por arquivo
+    for i in range(0, len(targets), STRIP_BATCH):
+        try:
+            run_cmd(["strip", "--strip-unneeded", *targets[i:i + STRIP_BATCH]], check=False)
+        except Exception:
+            pass
 
 
 def collect_file_list(destdir: Path) -> List[str]:
+    # só strings: o relativo sai cortando o prefixo de destdir
+    destdir_s = str(destdir).rstrip(os.sep)
+    n = len(destdir_s) + 1
     files: List[str] = []
-    for root, _, names in os.walk(destdir):
-        for n in names:
-            p = Path(root) / n
-            rel = str(p.relative_to(destdir))
-            files.append(rel)
+    stack = [destdir_s]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                # como no os.walk: link p/ diretório não é seguido nem listado
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        stack.append(entry.path)
+                else:
+                    files.append(entry.path[n:])
     files.sort()
     return files
 
@@ -336,8 +655,24 @@ def package_destdir(pkgname: str, version: str, destdir: Path) -> Path:
     pkgfile = PACKAGES_DIR / f"{pkgname}-{version}.tar.gz"
     print(c(f"📦 Empacotando {pkgfile.name}…", Color.MAGENTA))
     PACKAGES_DIR.mkdir(parents=True, exist_ok=True)
-    with tarfile.open(pkgfile, "w:gz") as tar:
-        tar.add(str(destdir), arcname=".")
+    pigz = which("pigz")
+    if pigz:
+        # tar em stream (sem compressão) -> pigz usando todos os núcleos
+        with open(pkgfile, "wb") as out:
+            proc = subprocess.Popen([pigz, "-p", str(os.cpu_count() or 1), "-c"], stdin=subprocess.PIPE, stdout=out)
+            try:
+                with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                    tar.add(str(destdir), arcname=".")
+            finally:
+                proc.stdin.close()
+                ret = proc.wait()
+        if ret != 0:
+            raise subprocess.CalledProcessError(ret, [pigz])
+        return pkgfile
+    # fallback: gzip do Python, nível 1 e escrita com buffer grande
+    with open(pkgfile, "wb") as raw, io.BufferedWriter(raw, buffer_size=2 * 1024 * 1024) as buf:
+        with tarfile.open(fileobj=buf, mode="w:gz", compresslevel=1) as tar:
+            tar.add(str(destdir), arcname=".")
     return pkgfile
 
 
@@ -350,7 +685,9 @@ def copy_binaries_to_bindir(destdir: Path) -> List[str]:
             for f in d.iterdir():
                 if f.is_file() and os.access(str(f), os.X_OK):
                     target = BIN_DIR / f.name
-                    shutil.copy2(str(f), str(target))
+                    with open(f, "rb") as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+                    shutil.copystat(str(f), str(target))
                     copied.append(str(target))
                     print(c(f"👉 Binário disponível: {target}", Color.BLUE))
     return copied
@@ -363,20 +700,38 @@ def safe_join(root: Path, rel: str) -> Path:
     return p
 
 
-def install_package_files(pkgfile: Path, target_root: Path) -> List[str]:
-    """Extrai o pacote para target_root e retorna a lista de arquivos realmente criados."""
-    created: List[str] = []
+def _member_relpath(name: str) -> str:
+    """'./usr/bin/x' -> 'usr/bin/x' sem criar Path (mesmo resultado de str(Path(name)))."""
+    name = name.rstrip("/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name or "."
+
+
+def _deep_first(paths) -> List[str]:
+    # mais profundos primeiro: a remoção só percorre a lista
+    return sorted(paths, key=lambda p: (-p.count("/"), p))
+
+
+def install_package_files(pkgfile: Path, target_root: Path) -> Tuple[List[str], List[str]]:
+    """Extrai o pacote para target_root e retorna (arquivos, diretórios) criados, já em ordem de remoção."""
     with tarfile.open(pkgfile, "r:gz") as tar:
-        members = tar.getmembers()
+        if hasattr(tarfile, "fully_trusted_filter"):  # pacote gerado por nós mesmos
+            tar.extraction_filter = tarfile.fully_trusted_filter
+        members = tar.getmembers()  # já em ordem de offset: leitura sequencial do gzip
+        files: List[str] = []
+        dirs: List[str] = []
         for m in members:
             # Rejeita caminhos absolutos
             if m.name.startswith("/"):
                 raise RuntimeError(f"Entrada inválida no tar: {m.name}")
-        tar.extractall(path=str(target_root))
-        for m in members:
-            path = target_root / m.name
-            created.append(str(Path(m.name)))
-    return sorted(list({p for p in created}))
+            rel = _member_relpath(m.name)
+            if not m.isdir():
+                files.append(rel)
+            elif rel != ".":  # a própria raiz não pertence ao pacote
+                dirs.append(rel)
+        tar.extractall(path=str(target_root), members=members)
+    return _deep_first(files), _deep_first(dirs)
 
 
 def run_hooks(hooks: List[str], stage: str, workdir: Path, env=None, log_file: Optional[Path]=None):
@@ -414,6 +769,24 @@ class Installer:
             return
         self._build_and_install(r)
 
+    def _collect_sources(self, name: str, visited: Optional[set]=None) -> List[Tuple[str, Path, Optional[str]]]:
+        """(url, dest_dir, sha256) de fontes HTTP e patches de name e das deps não instaladas, em ordem topológica."""
+        if visited is None:
+            visited = set()
+        if name in visited:
+            return []
+        visited.add(name)
+        r = self.recipes.find(name)
+        jobs: List[Tuple[str, Path, Optional[str]]] = []
+        for d in r.deps:
+            if d not in self.db.data:
+                jobs.extend(self._collect_sources(d, visited))
+        if name not in self.db.data:
+            if r.url and not r.url.startswith("git+"):
+                jobs.append((r.url, SOURCES_DIR, r.sha256))
+            jobs.extend((u, PATCHES_DIR, None) for u in r.patches)
+        return jobs
+
     def _build_and_install(self, recipe: Recipe):
         name, version = recipe.name, recipe.version
         log_file = LOGS_DIR / f"{name}.log"
@@ -426,9 +799,10 @@ class Installer:
 
         # Download fonte
         if recipe.url.startswith("git+"):
-            src_dir = git_download(recipe.url[len("git+"):], SOURCES_DIR)
+            git_url, ref = split_git_ref(recipe.url[len("git+"):])
+            src_dir = git_download(git_url, SOURCES_DIR, ref)
         else:
-            tarball = http_download(recipe.url, SOURCES_DIR)
+            tarball = http_download(recipe.url, SOURCES_DIR, sha256=recipe.sha256)
             src_dir = extract_tar_any(tarball, SOURCES_DIR)
 
         # Aplicar patches
@@ -468,7 +842,7 @@ class Installer:
 
         # Instalar no root alvo
         print(c(f"📥 Instalando em {self.target_root}…", Color.CYAN))
-        created_files = install_package_files(pkgfile, self.target_root)
+        created_files, created_dirs = install_package_files(pkgfile, self.target_root)
 
         # POST INSTALL hooks
         run_hooks(recipe.post_install, "post_install", workdir=src_dir, log_file=log_file)
@@ -476,7 +850,8 @@ class Installer:
         # Registrar no DB
         self.db.data[name] = {
             "version": version,
-            "files": created_files,  # caminhos relativos em relação ao root
+            "files": created_files,  # caminhos relativos em relação ao root, mais profundos primeiro
+            "dirs": created_dirs,
             "package_file": str(pkgfile),
             "destdir": str(destdir),
             "bin_files": bin_copied,
@@ -489,6 +864,8 @@ class Installer:
 
     # API pública
     def install(self, name: str):
+        # fontes de toda a árvore baixadas antes; as builds seguem em série
+        download_all(self._collect_sources(name))
         self._install_with_deps(name, visited=set())
 
     def build_only(self, name: str):
@@ -497,9 +874,10 @@ class Installer:
         print(c(f"\n==> build-only {r.name}-{r.version}", Color.CYAN))
         # Download
         if r.url.startswith("git+"):
-            src_dir = git_download(r.url[len("git+"):], SOURCES_DIR)
+            git_url, ref = split_git_ref(r.url[len("git+"):])
+            src_dir = git_download(git_url, SOURCES_DIR, ref)
         else:
-            tarball = http_download(r.url, SOURCES_DIR)
+            tarball = http_download(r.url, SOURCES_DIR, sha256=r.sha256)
             src_dir = extract_tar_any(tarball, SOURCES_DIR)
         # patches
         apply_patches(r.patches, src_dir)
@@ -527,6 +905,7 @@ class Installer:
             r = None
         target_root = Path(meta.get("installed_root", "/"))
         files: List[str] = meta.get("files", [])
+        dirs: Optional[List[str]] = meta.get("dirs")
 
         # PRE REMOVE hooks
         if r:
@@ -534,23 +913,40 @@ class Installer:
 
         # Remover arquivos
         removed = 0
-        for rel in sorted(files, key=lambda p: len(p.split("/")), reverse=True):
-            # segurança: só remover dentro de prefixes conhecidos (quando root real)
-            abs_path = (target_root / rel).resolve()
-            try:
-                if target_root.resolve() == Path("/"):
-                    if not any(str(abs_path).startswith(pref) for pref in ALLOWED_REMOVE_PREFIXES):
-                        continue
-                if abs_path.is_symlink() or abs_path.is_file():
-                    abs_path.unlink(missing_ok=True)
+        root_abs = str(target_root.resolve())
+        root_is_fs_root = root_abs == "/"
+        allowed = tuple(ALLOWED_REMOVE_PREFIXES)
+        def targets(rels):
+            for rel in rels:
+                abs_path = os.path.normpath(os.path.join(root_abs, rel))
+                # segurança: só remover dentro de prefixes conhecidos (quando root real)
+                if not root_is_fs_root or abs_path.startswith(allowed):
+                    yield abs_path
+        if dirs is None:
+            # registro antigo: arquivos e diretórios misturados, sem ordem
+            for abs_path in targets(sorted(files, key=lambda p: len(p.split("/")), reverse=True)):
+                try:
+                    st = os.lstat(abs_path)
+                    if stat.S_ISLNK(st.st_mode) or stat.S_ISREG(st.st_mode):
+                        os.unlink(abs_path)
+                        removed += 1
+                    elif stat.S_ISDIR(st.st_mode):
+                        os.rmdir(abs_path)
+                except OSError:
+                    pass
+        else:
+            # listas já ordenadas no install: sem sort e sem lstat
+            for abs_path in targets(files):
+                try:
+                    os.unlink(abs_path)
                     removed += 1
-                elif abs_path.is_dir():
-                    try:
-                        abs_path.rmdir()
-                    except OSError:
-                        pass
-            except Exception:
-                pass
+                except OSError:
+                    pass
+            for abs_path in targets(dirs):
+                try:
+                    os.rmdir(abs_path)  # falha se ainda houver conteúdo de outro pacote
+                except OSError:
+                    pass
         # Limpar BIN_DIR copiados
         for b in meta.get("bin_files", []):
             try:
@@ -576,10 +972,11 @@ class Installer:
         if all_pkgs:
             if not self.db.data:
                 print(c("Nada para upgrade.", Color.YELLOW)); return
-            for pkg in list(self.db.data.keys()):
-                print(c(f"🔄 Upgrade {pkg}…", Color.CYAN))
-                self.remove(pkg)
-                self.install(pkg)
+            with self.db.batch():
+                for pkg in list(self.db.data.keys()):
+                    print(c(f"🔄 Upgrade {pkg}…", Color.CYAN))
+                    self.remove(pkg)
+                    self.install(pkg)
         else:
             if not name:
                 print(c("Especifique um pacote ou use --all.", Color.RED)); return
@@ -624,16 +1021,18 @@ def sync_repo(url: str):
     ensure_dirs()
     if not (REPO_DIR / ".git").exists():
         print(c(f"📥 Clonando {url} em {REPO_DIR}…", Color.CYAN))
-        run_cmd(["git", "clone", url, str(REPO_DIR)])
+        run_cmd(["git", "clone", "--depth=1", "--single-branch", url, str(REPO_DIR)])
     else:
         print(c(f"🔄 Atualizando {REPO_DIR}…", Color.CYAN))
-        run_cmd(["git", "-C", str(REPO_DIR), "pull"])
+        run_cmd(["git", "-C", str(REPO_DIR), "fetch", "--depth=1", "origin", "HEAD"])
+        run_cmd(["git", "-C", str(REPO_DIR), "reset", "--hard", "FETCH_HEAD"])
     RecipeIndex.build()
     print(c("✅ Índice de recipes atualizado.", Color.GREEN))
 
 
 def reindex_repo():
     RecipeIndex.build()
+    clear_recipe_cache()
     print(c("✅ Índice reconstruído.", Color.GREEN))
 
 